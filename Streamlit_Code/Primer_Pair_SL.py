@@ -7,56 +7,37 @@ Created on Thu Oct 17 14:16:30 2024
 """
 import streamlit as st
 import pandas as pd
-import random
-from collections import Counter
+import numpy as np
 from io import BytesIO
+from primer_selection import SEQ_LEN, BASES, load_primers, solve_ilp, write_sheet
 
-# Function to calculate nucleotide frequencies for a list of primers
-def calculate_nucleotide_frequencies(primers):
-    nucleotide_counts = [Counter() for _ in range(len(next(iter(primers.values()))))]
-    for seq in primers.values():
-        for i, nucleotide in enumerate(seq):
-            nucleotide_counts[i][nucleotide] += 1
-    return nucleotide_counts
-
-# Function to calculate a diversity score
-def calculate_diversity_score(nucleotide_counts, total_primers):
-    ideal_count = total_primers / 4
-    score = sum(abs(ideal_count - count) for pos in nucleotide_counts for count in pos.values())
-    return score
-
-# Function to select the optimal combination of primers
-def select_optimal_primers(forward_primers, reverse_primers, num_forward, num_reverse):
-    best_score = float('inf')
-    best_combination = None
-
-    for _ in range(10000):
-        selected_forward_keys = random.sample(list(forward_primers.keys()), num_forward)
-        selected_reverse_keys = random.sample(list(reverse_primers.keys()), num_reverse)
-
-        selected_forward = {key: forward_primers[key] for key in selected_forward_keys}
-        selected_reverse = {key: reverse_primers[key] for key in selected_reverse_keys}
-
-        forward_frequencies = calculate_nucleotide_frequencies(selected_forward)
-        reverse_frequencies = calculate_nucleotide_frequencies(selected_reverse)
-
-        total_frequencies = [Counter() for _ in range(8)]
-        for i in range(8):
-            total_frequencies[i] = forward_frequencies[i] + reverse_frequencies[i]
+# Function to pack a list of primer sequences into an (N, SEQ_LEN) array of ASCII codes
+def pack_sequences(sequences):
+    return np.frombuffer(''.join(sequences).encode('ascii'), dtype=np.uint8).reshape(-1, SEQ_LEN)
 
-        score = calculate_diversity_score(total_frequencies, num_forward + num_reverse)
+# Lookup table from ASCII code to base row (A, T, C, G -> 0-3, anything else -> 4)
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+BASE_CODES[list(BASES.encode('ascii'))] = np.arange(4)
 
-        if score < best_score:
-            best_score = score
-            best_combination = (selected_forward, selected_reverse)
+# Function to calculate nucleotide frequencies (rows A, T, C, G) for a packed array of primers
+def calculate_nucleotide_frequencies(seq_bytes):
+    bins = BASE_CODES[seq_bytes] * SEQ_LEN + np.arange(SEQ_LEN)
+    return np.bincount(bins.ravel(), minlength=5 * SEQ_LEN).reshape(5, SEQ_LEN)[:4]
 
-    return best_combination, best_score, total_frequencies
+# Function to select the optimal combination of primers by solving the ILP
+def select_optimal_primers(forward_primers, reverse_primers, num_forward, num_reverse):
+    selected_forward, selected_reverse, objective, optimal = solve_ilp(
+        forward_primers, reverse_primers, num_forward, num_reverse, set()
+    )
+    selected_forward = {key: forward_primers[key] for key in selected_forward}
+    selected_reverse = {key: reverse_primers[key] for key in selected_reverse}
+    return (selected_forward, selected_reverse), objective, optimal
 
 # Function to create the nucleotide matrix
 def create_nucleotide_matrix(frequencies):
-    data = {'Basepair position': ['A', 'T', 'C', 'G']}
-    for pos in range(8):
-        counts = [frequencies[pos].get(base, 0) for base in 'ATCG']
+    data = {'Basepair position': list(BASES)}
+    for pos in range(SEQ_LEN):
+        counts = frequencies[:, pos].tolist()
         data[pos + 1] = counts
 
     matrix_df = pd.DataFrame(data)
@@ -65,6 +46,12 @@ def create_nucleotide_matrix(frequencies):
     matrix_df = pd.concat([matrix_df, sum_row], ignore_index=True)
     return matrix_df
 
+# Function to read the excluded primer names from the uploaded file
+@st.cache_data
+def load_excluded_primers(data):
+    excluded_primers_df = pd.read_excel(BytesIO(data))
+    return set(excluded_primers_df['indexname'])
+
 # Streamlit UI
 st.title("Primer Pair Optimization App")
 
@@ -82,20 +69,15 @@ include_excluded = st.checkbox("Include excluded primers?", value=False)
 
 if primer_file:
     # Load data from the uploaded primer file
-    primers_df = pd.read_excel(primer_file)
-
-    # Split the primers into forward and reverse based on the 'type' column
-    forward_primers_df = primers_df[primers_df['type'].str.lower() == 'forward']
-    reverse_primers_df = primers_df[primers_df['type'].str.lower() == 'reverse']
-
-    # Convert DataFrames to dictionaries
-    forward_primers = dict(zip(forward_primers_df['indexname'], forward_primers_df['sequence']))
-    reverse_primers = dict(zip(reverse_primers_df['indexname'], reverse_primers_df['sequence']))
+    try:
+        forward_primers, reverse_primers = load_primers(primer_file.getvalue())
+    except ValueError as error:
+        st.error(str(error))
+        st.stop()
 
     # Handle optional excluded primer logic
     if include_excluded and excluded_file:
-        excluded_primers_df = pd.read_excel(excluded_file)
-        excluded_primers = set(excluded_primers_df['indexname'])
+        excluded_primers = load_excluded_primers(excluded_file.getvalue())
         forward_primers = {name: seq for name, seq in forward_primers.items() if name not in excluded_primers}
         reverse_primers = {name: seq for name, seq in reverse_primers.items() if name not in excluded_primers}
 
@@ -106,38 +88,44 @@ if primer_file:
     num_forward = st.slider("Number of Forward Primers to Use", min_value=1, max_value=max_forward, value=5)
     num_reverse = st.slider("Number of Reverse Primers to Use", min_value=1, max_value=max_reverse, value=10)
 
-    # Select optimal primers
-    optimal_primers, diversity_score, total_frequencies = select_optimal_primers(
-        forward_primers, reverse_primers, num_forward, num_reverse
-    )
-
-    # Combine primers into a DataFrame
-    combined_primers = {**optimal_primers[0], **optimal_primers[1]}
-    primers_df = pd.DataFrame(list(combined_primers.items()), columns=["indexname", "sequence"])
-
-    # Create nucleotide matrix
-    matrix_df = create_nucleotide_matrix(total_frequencies)
-
-    # Display the matrix as a table in Streamlit
-    st.subheader("Nucleotide Frequency Matrix")
-    st.table(matrix_df)
-
-    # Save the optimal primers to an Excel file for download
-    def to_excel(df):
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Optimal Primers', index=False)
-        return output.getvalue()
-
-    excel_data = to_excel(primers_df)
-
-    # Provide a download button for the primer pairs
-    st.download_button(
-        label="Download Optimal Primer Pairs",
-        data=excel_data,
-        file_name="optimal_primers.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    # Solve only on request, so moving a slider doesn't start a new solve
+    if st.button("Run Optimization"):
+        # Select optimal primers
+        optimal_primers, diversity_score, optimal = select_optimal_primers(
+            forward_primers, reverse_primers, num_forward, num_reverse
+        )
+        if not optimal:
+            st.warning("The solver hit its time limit, so this selection may not be optimal.")
+        selected_sequences = [*optimal_primers[0].values(), *optimal_primers[1].values()]
+        total_frequencies = calculate_nucleotide_frequencies(pack_sequences(selected_sequences))
+
+        # Combine primers into a DataFrame
+        combined_primers = {**optimal_primers[0], **optimal_primers[1]}
+        primers_df = pd.DataFrame(list(combined_primers.items()), columns=["indexname", "sequence"])
+
+        # Create nucleotide matrix
+        matrix_df = create_nucleotide_matrix(total_frequencies)
+
+        # Display the matrix as a table in Streamlit
+        st.subheader("Nucleotide Frequency Matrix")
+        st.table(matrix_df)
+
+        # Save the optimal primers to an Excel file for download
+        def to_excel(df):
+            output = BytesIO()
+            with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': True}}) as writer:
+                write_sheet(writer.book, 'Optimal Primers', df)
+            return output.getvalue()
+
+        excel_data = to_excel(primers_df)
+
+        # Provide a download button for the primer pairs
+        st.download_button(
+            label="Download Optimal Primer Pairs",
+            data=excel_data,
+            file_name="optimal_primers.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
 else:
     st.warning("Please upload the primer file.")
 
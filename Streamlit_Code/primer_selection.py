@@ -0,0 +1,219 @@
+"""
+Primer selection helpers shared by the Primer Pair Streamlit apps
+"""
+import streamlit as st
+import pandas as pd
+import pulp
+from collections import defaultdict
+from io import BytesIO
+import os
+
+# Primer length and the bases counted at each position
+SEQ_LEN = 8
+BASES = 'ATCG'
+
+# Function to set up the bundled CBC solver, capped so a hard instance can't hang the app
+def get_solver():
+    return pulp.PULP_CBC_CMD(msg=False, threads=os.cpu_count(), timeLimit=60)
+
+# Function to read the forward and reverse primers from the uploaded primer file
+@st.cache_data
+def load_primers(data):
+    primers_df = pd.read_excel(BytesIO(data))
+
+    # Normalise the sequences and reject any the per-position counts can't represent
+    primers_df['sequence'] = primers_df['sequence'].astype(str).str.strip().str.upper()
+    invalid = primers_df.loc[~primers_df['sequence'].str.fullmatch(f"[{BASES}]{{{SEQ_LEN}}}"), 'indexname']
+    if not invalid.empty:
+        raise ValueError(
+            f"Primer sequences must be {SEQ_LEN} bases of {BASES}. Invalid primers: {', '.join(map(str, invalid))}"
+        )
+
+    # Split the primers into forward and reverse based on the 'type' column
+    primers_df['type'] = primers_df['type'].str.lower().astype('category')
+    forward_primers_df = primers_df[primers_df['type'] == 'forward']
+    reverse_primers_df = primers_df[primers_df['type'] == 'reverse']
+
+    # Convert DataFrames to dictionaries
+    forward_primers = dict(zip(forward_primers_df['indexname'], forward_primers_df['sequence']))
+    reverse_primers = dict(zip(reverse_primers_df['indexname'], reverse_primers_df['sequence']))
+    return forward_primers, reverse_primers
+
+# Function to write a DataFrame to a new worksheet in row order, as xlsxwriter's constant_memory mode requires
+def write_sheet(workbook, sheet_name, df):
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, df.columns, workbook.add_format({'bold': True}))
+    for row_num, row in enumerate(df.itertuples(index=False), start=1):
+        # xlsxwriter can't write NaN, so leave missing values as blank cells
+        worksheet.write_row(row_num, 0, [None if pd.isna(value) else value for value in row])
+
+# Function to greedily pick primers whose bases keep the counts at each position close to an even split
+def greedy_primer_selection(forward_primers, reverse_primers, num_forward, num_reverse, used_pairs):
+    counts = defaultdict(int)
+    selected_forward, selected_reverse = set(), set()
+
+    # Primers that may not be picked alongside a given primer because they form a used pair
+    forward_partners, reverse_partners = defaultdict(set), defaultdict(set)
+    for fwd, rev in used_pairs:
+        forward_partners[fwd].add(rev)
+        reverse_partners[rev].add(fwd)
+
+    sides = (
+        (forward_primers, selected_forward, num_forward, forward_partners, selected_reverse),
+        (reverse_primers, selected_reverse, num_reverse, reverse_partners, selected_forward),
+    )
+
+    # Add one primer at a time, keeping the running counts closest to an even split
+    for step in range(num_forward + num_reverse):
+        target = (step + 1) / 4
+        best = None
+        for primers, selected, limit, partners, other_selected in sides:
+            if len(selected) == limit:
+                continue
+            for key, seq in primers.items():
+                if key in selected or partners[key] & other_selected:
+                    continue
+                change = sum(
+                    abs(counts[(position, base)] + 1 - target) - abs(counts[(position, base)] - target)
+                    for position, base in enumerate(seq)
+                )
+                if best is None or change < best[0]:
+                    best = (change, key, seq, selected)
+
+        # Used pairs ruled out every remaining primer
+        if best is None:
+            return None
+
+        _, key, seq, selected = best
+        selected.add(key)
+        for position, base in enumerate(seq):
+            counts[(position, base)] += 1
+
+    # Swap selected primers for unselected ones for as long as that lowers the total deviation
+    ideal_count = (num_forward + num_reverse) / 4
+    improved = True
+    while improved:
+        improved = False
+        for primers, selected, _, partners, other_selected in sides:
+            for old_key in list(selected):
+                old_seq = primers[old_key]
+                for new_key, new_seq in primers.items():
+                    if new_key in selected or partners[new_key] & other_selected:
+                        continue
+                    change = 0
+                    for position, (old_base, new_base) in enumerate(zip(old_seq, new_seq)):
+                        if old_base != new_base:
+                            old_count = counts[(position, old_base)]
+                            new_count = counts[(position, new_base)]
+                            change += abs(old_count - 1 - ideal_count) - abs(old_count - ideal_count)
+                            change += abs(new_count + 1 - ideal_count) - abs(new_count - ideal_count)
+                    if change < 0:
+                        selected.remove(old_key)
+                        selected.add(new_key)
+                        for position, (old_base, new_base) in enumerate(zip(old_seq, new_seq)):
+                            counts[(position, old_base)] -= 1
+                            counts[(position, new_base)] += 1
+                        improved = True
+                        break
+
+    objective = sum(abs(counts[(position, base)] - ideal_count) for position in range(SEQ_LEN) for base in BASES)
+    selected_forward = [key for key in forward_primers if key in selected_forward]
+    selected_reverse = [key for key in reverse_primers if key in selected_reverse]
+    return selected_forward, selected_reverse, objective
+
+# Function to group primers the ILP can't tell apart: same sequence and the same used-pair partners
+def group_interchangeable_primers(primers, partners):
+    groups = defaultdict(list)
+    for key, seq in primers.items():
+        groups[(seq, frozenset(partners.get(key, ())))].append(key)
+    return [keys for keys in groups.values() if len(keys) > 1]
+
+# Function to build and solve the primer selection ILP
+@st.cache_data(show_spinner="Solving ILP...")
+def solve_ilp(forward_primers, reverse_primers, num_forward_to_select, num_reverse_to_select, used_pairs):
+    # Skip the solver when a greedy pick already meets the lower bound on the objective
+    remainder = (num_forward_to_select + num_reverse_to_select) % 4
+    greedy = greedy_primer_selection(
+        forward_primers, reverse_primers, num_forward_to_select, num_reverse_to_select, used_pairs
+    )
+    if greedy is not None and greedy[2] == SEQ_LEN * remainder * (4 - remainder) / 2:
+        return (*greedy, True)
+
+    # Set up the ILP problem
+    problem = pulp.LpProblem("Primer_Selection", pulp.LpMinimize)
+
+    forward_vars = {key: pulp.LpVariable(f"f_{key}", cat="Binary") for key in forward_primers}
+    reverse_vars = {key: pulp.LpVariable(f"r_{key}", cat="Binary") for key in reverse_primers}
+
+    # Set up deviation variables for nucleotide distribution
+    deviation_vars = {
+        (position, base): pulp.LpVariable(f"dev_{position}_{base}", lowBound=0)
+        for position in range(SEQ_LEN) for base in BASES
+    }
+    ideal_count = (num_forward_to_select + num_reverse_to_select) / 4
+
+    # Index primers by the base they carry at each position
+    forward_index = defaultdict(list)
+    for key, seq in forward_primers.items():
+        for position, base in enumerate(seq):
+            forward_index[(position, base)].append(key)
+    reverse_index = defaultdict(list)
+    for key, seq in reverse_primers.items():
+        for position, base in enumerate(seq):
+            reverse_index[(position, base)].append(key)
+
+    # Add nucleotide distribution constraints
+    for position in range(SEQ_LEN):
+        for base in BASES:
+            # Build the count straight from a {variable: 1} dict rather than summing term by term
+            counted = {forward_vars[key]: 1 for key in forward_index[(position, base)]}
+            counted.update((reverse_vars[key], 1) for key in reverse_index[(position, base)])
+            total_count = pulp.LpAffineExpression(counted)
+            problem += deviation_vars[(position, base)] >= ideal_count - total_count
+            problem += deviation_vars[(position, base)] >= total_count - ideal_count
+
+    # Integer counts can't all hit a fractional ideal, so bound the deviation at each position
+    for position in range(SEQ_LEN):
+        problem += pulp.lpSum(deviation_vars[(position, base)] for base in BASES) >= remainder * (4 - remainder) / 2
+
+    # Objective to minimize the deviation from ideal distribution
+    problem += pulp.lpSum(deviation_vars.values())
+
+    # Add constraints for selecting primers
+    problem += pulp.lpSum(forward_vars[key] for key in forward_vars) == num_forward_to_select
+    problem += pulp.lpSum(reverse_vars[key] for key in reverse_vars) == num_reverse_to_select
+
+    # Exclude used primer pairs, grouped into one constraint per forward primer
+    used_reverses, used_forwards = defaultdict(set), defaultdict(set)
+    for fwd, rev in used_pairs:
+        if fwd in forward_vars and rev in reverse_vars:
+            used_reverses[fwd].add(rev)
+            used_forwards[rev].add(fwd)
+    for fwd in sorted(used_reverses, key=str):
+        revs = sorted(used_reverses[fwd], key=str)
+        # Selecting the forward primer forces every reverse it was used with to zero
+        problem += len(revs) * forward_vars[fwd] + pulp.lpSum(reverse_vars[rev] for rev in revs) <= len(revs)
+
+    # Break symmetry between interchangeable primers by always selecting them in catalogue order
+    forward_groups = group_interchangeable_primers(forward_primers, used_reverses)
+    reverse_groups = group_interchangeable_primers(reverse_primers, used_forwards)
+    for variables, groups in ((forward_vars, forward_groups), (reverse_vars, reverse_groups)):
+        for keys in groups:
+            for first, second in zip(keys, keys[1:]):
+                problem += variables[first] >= variables[second]
+
+    # Run optimization
+    problem.solve(get_solver())
+
+    # Extract selected forward and reverse primers
+    selected_forward_primers = [key for key in forward_vars if round(forward_vars[key].varValue or 0) == 1]
+    selected_reverse_primers = [key for key in reverse_vars if round(reverse_vars[key].varValue or 0) == 1]
+
+    # CBC keeps its best selection so far when the time cap stops it, so flag whether it proved optimality
+    optimal = problem.sol_status == pulp.LpSolutionOptimal
+    objective = pulp.value(problem.objective)
+
+    # A capped run can stop short of the greedy pick, so keep whichever is better
+    if greedy is not None and (objective is None or greedy[2] < objective):
+        return (*greedy, optimal)
+    return selected_forward_primers, selected_reverse_primers, objective, optimal